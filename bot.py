@@ -1,32 +1,42 @@
 import os
 import json
+import asyncio
 import logging
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from datetime import datetime, timezone
-from io import BytesIO
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
 from telegram import (
     Update,
+    CallbackQuery,
+    Message,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    ReplyKeyboardRemove,
 )
 from telegram.constants import ParseMode
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
     ContextTypes,
+    PersistenceInput,
+    PicklePersistence,
     filters,
 )
-from telegram.helpers import escape_markdown
 
 from scraper import TikTokScraper
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 load_dotenv()
 
 logging.basicConfig(
@@ -36,15 +46,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", "bot_data.pickle")
 
 # Conversation states
 WAITING_USERNAME, WAITING_ID, WAITING_VIDEO_URL, WAITING_COMPARE = range(4)
 
-# Rate limit storage: {user_id: {"count": int, "start_time": datetime}}
-rate_limit = {}
+# Rate limit buckets: {user_id: {"tokens": float, "last_ts": float}}
+rate_limit = OrderedDict()
 RATE_LIMIT_COUNT = 20
 RATE_LIMIT_WINDOW = 300  # 5 minutes
-RATE_LIMIT_COOLDOWN = 600  # 10 minutes
+RATE_LIMIT_MAX_USERS = 50_000
+STATE_GC_INTERVAL = 600  # 10 minutes
 
 # User language preferences: {user_id: "ar" or "en"}
 user_langs = {}
@@ -52,8 +64,32 @@ user_langs = {}
 # Language strings cache
 lang_strings = {}
 
+# Resolved strings: {(lang, key): text}, falling back to Arabic then the key
+_resolved = {}
+
+# MarkdownV2-escaped strings: {(lang, key): escaped text}
+_escaped_labels = {}
+
+# Result keyboard labels: {lang: (refresh, raw_data, add_fav)}
+_result_labels = {}
+
+# MarkdownV2 special characters, escaped in a single str.translate pass
+_MDV2_TABLE = str.maketrans({c: "\\" + c for c in r"\_*[]()~`>#+-=|{}.!"})
+
 scraper = TikTokScraper()
 
+# Profile cache: {"username_lower" or "id:<tiktok_id>": (expiry_ts, result)}
+profile_cache = OrderedDict()
+PROFILE_CACHE_TTL = 60  # 1 minute
+PROFILE_CACHE_MAX_ENTRIES = 512
+
+# Telegram file_id of sent profile pictures: {profile_pic_url: file_id}
+photo_cache = OrderedDict()
+PHOTO_CACHE_MAX_ENTRIES = 2048
+
+# In-flight lookups shared by concurrent callers: {cache key: asyncio.Future}
+_inflight = {}
+
 
 def load_languages():
     """Load language files."""
@@ -62,56 +98,159 @@ def load_languages():
     for lang_file in ["ar.json", "en.json"]:
         lang_code = lang_file.replace(".json", "")
         filepath = os.path.join(lang_dir, lang_file)
-        with open(filepath, "r", encoding="utf-8") as f:
-            lang_strings[lang_code] = json.load(f)
+        with open(filepath, "rb") as f:
+            raw = f.read()
+        lang_strings[lang_code] = orjson.loads(raw) if HAS_ORJSON else json.loads(raw)
+
+    keys = set().union(*lang_strings.values())
+    for lang_code, strings in lang_strings.items():
+        for key in keys:
+            text = strings.get(key, lang_strings["ar"].get(key, key))
+            _resolved[(lang_code, key)] = text
+            _escaped_labels[(lang_code, key)] = esc(text)
+        _result_labels[lang_code] = tuple(
+            _resolved[(lang_code, key)] for key in ("refresh", "raw_data", "add_fav")
+        )
+
+
+def esc(value) -> str:
+    """Escape a value for Telegram MarkdownV2."""
+    return str(value).translate(_MDV2_TABLE)
+
+
+@lru_cache(maxsize=4096)
+def esc_cached(value: str) -> str:
+    """Escape a frequently repeated value (region, yes/no, N/A) for MarkdownV2."""
+    return value.translate(_MDV2_TABLE)
+
+
+# Fields whose values repeat across users, escaped through esc_cached
+_LOW_CARDINALITY_FIELDS = {"verified", "private", "region", "language_field"}
 
 
 def t(user_id: int, key: str, **kwargs) -> str:
     """Get translated string for user."""
     lang = user_langs.get(user_id, "ar")
-    text = lang_strings.get(lang, lang_strings["ar"]).get(key, key)
-    if kwargs:
-        text = text.format(**kwargs)
-    return text
+    text = _resolved.get((lang, key)) or _resolved.get(("ar", key), key)
+    return text.format(**kwargs) if kwargs else text
 
 
 def check_rate_limit(user_id: int) -> tuple[bool, int, int]:
     """Check if user is rate limited. Returns (is_limited, minutes, seconds)."""
-    current_time = datetime.now(timezone.utc)
-
-    if user_id not in rate_limit:
-        rate_limit[user_id] = {"count": 0, "start_time": current_time}
-
-    user_data = rate_limit[user_id]
-    elapsed = (current_time - user_data["start_time"]).total_seconds()
-
-    if elapsed > RATE_LIMIT_WINDOW:
-        user_data["count"] = 1
-        user_data["start_time"] = current_time
-        return False, 0, 0
+    current_time = time.monotonic()
+
+    bucket = rate_limit.get(user_id)
+    if bucket is None:
+        bucket = {"tokens": float(RATE_LIMIT_COUNT), "last_ts": current_time}
+        rate_limit[user_id] = bucket
+        while len(rate_limit) > RATE_LIMIT_MAX_USERS:
+            rate_limit.popitem(last=False)
+    else:
+        elapsed = current_time - bucket["last_ts"]
+        bucket["tokens"] = min(
+            RATE_LIMIT_COUNT,
+            bucket["tokens"] + elapsed * RATE_LIMIT_COUNT / RATE_LIMIT_WINDOW,
+        )
+        bucket["last_ts"] = current_time
+        rate_limit.move_to_end(user_id)
 
-    if user_data["count"] >= RATE_LIMIT_COUNT:
-        remaining = RATE_LIMIT_COOLDOWN - elapsed
-        if remaining <= 0:
-            user_data["count"] = 1
-            user_data["start_time"] = current_time
-            return False, 0, 0
+    if bucket["tokens"] < 1:
+        remaining = (1 - bucket["tokens"]) * RATE_LIMIT_WINDOW / RATE_LIMIT_COUNT
         minutes = int(remaining // 60)
         seconds = int(remaining % 60)
         return True, minutes, seconds
 
-    user_data["count"] += 1
+    bucket["tokens"] -= 1
     return False, 0, 0
 
 
-# Search history: {user_id: [{"username": ..., "time": ...}, ...]}
-search_history = {}
+def _cache_get(key: str) -> dict | None:
+    """Return a cached scraper result if it has not expired."""
+    entry = profile_cache.get(key)
+    if entry is None:
+        return None
+    expiry, result = entry
+    if expiry < time.monotonic():
+        del profile_cache[key]
+        return None
+    profile_cache.move_to_end(key)
+    return result
+
+
+def _cache_put(key: str, result: dict):
+    """Store a scraper result, evicting the least recently used entries."""
+    profile_cache[key] = (time.monotonic() + PROFILE_CACHE_TTL, result)
+    profile_cache.move_to_end(key)
+    while len(profile_cache) > PROFILE_CACHE_MAX_ENTRIES:
+        profile_cache.popitem(last=False)
+
+
+async def _fetch_shared(key: str, fetch, *args) -> dict:
+    """Run a scraper lookup once per key, sharing it with concurrent callers."""
+    # A lookup that was cancelled or raised resolves to None; waiters then run their own
+    fut = _inflight.get(key)
+    while fut is not None:
+        result = await asyncio.shield(fut)
+        if result is not None:
+            return result
+        fut = _inflight.get(key)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await fetch(*args)
+        if not result.get("error"):
+            _cache_put(key, result)
+            _cache_put(result["username"].lower(), result)
+        fut.set_result(result)
+        return result
+    finally:
+        del _inflight[key]
+        if not fut.done():
+            fut.set_result(None)
+
+
+async def cached_get_user(username: str) -> dict:
+    """Fetch user by username, served from the profile cache when fresh."""
+    key = username.strip().lstrip("@").lower()
+    result = _cache_get(key)
+    if result is not None:
+        return result
+    return await _fetch_shared(key, scraper.get_user_by_username, username)
+
+
+async def cached_get_user_by_id(tiktok_id: str) -> dict:
+    """Fetch user by TikTok ID, served from the profile cache when fresh."""
+    key = f"id:{tiktok_id.strip()}"
+    result = _cache_get(key)
+    if result is not None:
+        return result
+    return await _fetch_shared(key, scraper.get_user_by_id, tiktok_id)
+
+
+async def fetch_pair(user1_name: str, user2_name: str) -> tuple[dict, dict]:
+    """Fetch two users concurrently for comparison."""
+    results = await asyncio.gather(
+        cached_get_user(user1_name),
+        cached_get_user(user2_name),
+        return_exceptions=True,
+    )
+    return tuple({"error": True} if isinstance(r, Exception) else r for r in results)
+
+
+# Search history: {user_id: deque([{"username": ..., "time": ...}, ...])}, least recently searched first
+search_history = OrderedDict()
+HISTORY_MAX = 10
+HISTORY_MAX_USERS = 5000
+HISTORY_IDLE_DAYS = 30
 
-# Favorites: {user_id: ["username1", "username2", ...]}
+# Favorites: {user_id: {"username_lower": "Username", ...}}
 favorites = {}
+FAVORITES_MAX = 50
 
 # Username tracker: {tiktok_user_id: [{"username": ..., "date": ...}, ...]}
-username_tracker = {}
+username_tracker = OrderedDict()
+USERNAME_TRACKER_MAX_ENTRIES = 5000
 
 
 def track_username(tiktok_uid: str, username: str) -> list:
@@ -121,7 +260,10 @@ def track_username(tiktok_uid: str, username: str) -> list:
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M")
     if tiktok_uid not in username_tracker:
         username_tracker[tiktok_uid] = [{"username": username, "date": now}]
+        while len(username_tracker) > USERNAME_TRACKER_MAX_ENTRIES:
+            username_tracker.popitem(last=False)
         return []
+    username_tracker.move_to_end(tiktok_uid)
     history = username_tracker[tiktok_uid]
     current = history[-1]["username"]
     if current != username:
@@ -132,20 +274,48 @@ def track_username(tiktok_uid: str, username: str) -> list:
 
 def save_to_history(user_id: int, username: str):
     """Save a search to user's history."""
-    if user_id not in search_history:
-        search_history[user_id] = []
-    search_history[user_id].insert(0, {
+    search_history.setdefault(user_id, deque(maxlen=HISTORY_MAX)).appendleft({
         "username": username,
         "time": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M"),
     })
-    if len(search_history[user_id]) > 20:
-        search_history[user_id] = search_history[user_id][:20]
+    search_history.move_to_end(user_id)
+    while len(search_history) > HISTORY_MAX_USERS:
+        search_history.popitem(last=False)
+
+
+def add_favorite(user_id: int, username: str) -> str:
+    """Add a favorite. Returns the translation key describing the outcome."""
+    key = username.lower()
+    user_favs = favorites.setdefault(user_id, {})
+    if key in user_favs:
+        return "fav_exists"
+    if len(user_favs) >= FAVORITES_MAX:
+        return "fav_full"
+    user_favs[key] = username
+    return "fav_added"
+
+
+async def prune_idle_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically drop idle or redundant per-user state."""
+    cutoff = time.monotonic() - RATE_LIMIT_WINDOW * 4
+    # Buckets idle this long are full again, same as a fresh bucket
+    for uid in [uid for uid, b in rate_limit.items() if b["last_ts"] < cutoff]:
+        del rate_limit[uid]
+    # "ar" is the default language, so storing it is redundant
+    for uid in [uid for uid, lang in user_langs.items() if lang == "ar"]:
+        del user_langs[uid]
+    # History timestamps use a sortable "%Y-%m-%d %H:%M" format, so plain string comparison works
+    history_cutoff = (datetime.now(timezone.utc) - timedelta(days=HISTORY_IDLE_DAYS)).strftime("%Y-%m-%d %H:%M")
+    for uid in [uid for uid, h in search_history.items() if not h or h[0]["time"] < history_cutoff]:
+        del search_history[uid]
+    for uid in [uid for uid, items in favorites.items() if not items]:
+        del favorites[uid]
 
 
 def build_user_response(data: dict, user_id: int) -> str:
     """Build formatted user info response."""
     lang = user_langs.get(user_id, "ar")
-    response = t(user_id, "account_details")
+    parts = [t(user_id, "account_details")]
 
     fields = [
         ("username", data["username"]),
@@ -168,53 +338,172 @@ def build_user_response(data: dict, user_id: int) -> str:
     ]
 
     for key, value in fields:
-        label = t(user_id, key)
-        safe_label = escape_markdown(label, version=2)
-        safe_value = escape_markdown(str(value), version=2)
-        response += f"*{safe_label}:* {safe_value}\n"
+        safe_label = _escaped_labels.get((lang, key)) or _escaped_labels[("ar", key)]
+        if key in _LOW_CARDINALITY_FIELDS:
+            safe_value = esc_cached(str(value))
+        else:
+            safe_value = esc(value)
+        parts.append(f"*{safe_label}:* {safe_value}\n")
 
     # Track username and show history
     tiktok_uid = str(data.get("user_id", ""))
     prev = track_username(tiktok_uid, data["username"])
     if prev:
         history_label = t(user_id, "prev_usernames")
-        safe_hl = escape_markdown(history_label, version=2)
-        response += f"\n*{safe_hl}:*\n"
+        safe_hl = esc(history_label)
+        parts.append(f"\n*{safe_hl}:*\n")
         for entry in prev:
-            safe_u = escape_markdown(f"@{entry['username']}", version=2)
-            safe_d = escape_markdown(entry['date'], version=2)
-            response += f"  ↩️ {safe_u} \({safe_d}\)\n"
+            safe_u = esc(f"@{entry['username']}")
+            safe_d = esc(entry['date'])
+            parts.append(f"  ↩️ {safe_u} \\({safe_d}\\)\n")
 
-    return response
+    return "".join(parts)
 
 
-# ─── Command Handlers ───────────────────────────────────────────────
+# Compare fields: (label_key, data_key)
+COMPARE_FIELDS = [
+    ("username", "username"), ("nickname", "nickname"),
+    ("followers", "followers"), ("following", "following"),
+    ("likes", "likes"), ("videos", "videos"),
+    ("verified", "verified"), ("created", "created"),
+    ("region", "region"), ("language_field", "language"),
+]
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /start command."""
-    user_id = update.effective_user.id
-    if user_id not in user_langs:
-        user_langs[user_id] = "ar"
+def build_compare_response(result1: dict, result2: dict, user_id: int) -> str:
+    """Build formatted side-by-side comparison of two users."""
+    lang = user_langs.get(user_id, "ar")
+    parts = [t(user_id, "compare_title")]
+    safe_vs = _escaped_labels.get((lang, "vs")) or _escaped_labels[("ar", "vs")]
+    for label_key, data_key in COMPARE_FIELDS:
+        v1 = result1.get(data_key, "N/A")
+        v2 = result2.get(data_key, "N/A")
+        if data_key == "verified":
+            v1 = t(user_id, "yes") if v1 else t(user_id, "no")
+            v2 = t(user_id, "yes") if v2 else t(user_id, "no")
+        escape = esc_cached if label_key in _LOW_CARDINALITY_FIELDS else esc
+        safe_label = _escaped_labels.get((lang, label_key)) or _escaped_labels[("ar", label_key)]
+        parts.append(f"*{safe_label}:*\n{escape(str(v1))} {safe_vs} {escape(str(v2))}\n\n")
+    return "".join(parts)
 
-    keyboard = [
+
+# ─── Keyboards ──────────────────────────────────────────────────────
+
+
+def _start_markup(search: str, video: str, compare: str, fav: str, history: str, language: str) -> InlineKeyboardMarkup:
+    """Build the /start menu keyboard."""
+    return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("🔍 " + ("بحث" if user_langs.get(user_id) == "ar" else "Search"), callback_data="action:search"),
+            InlineKeyboardButton("🔍 " + search, callback_data="action:search"),
             InlineKeyboardButton("🔢 ID", callback_data="action:id"),
         ],
         [
-            InlineKeyboardButton("🎥 " + ("فيديو" if user_langs.get(user_id) == "ar" else "Video"), callback_data="action:video"),
-            InlineKeyboardButton("⚖️ " + ("مقارنة" if user_langs.get(user_id) == "ar" else "Compare"), callback_data="action:compare"),
+            InlineKeyboardButton("🎥 " + video, callback_data="action:video"),
+            InlineKeyboardButton("⚖️ " + compare, callback_data="action:compare"),
         ],
         [
-            InlineKeyboardButton("⭐ " + ("المفضلة" if user_langs.get(user_id) == "ar" else "Favorites"), callback_data="action:fav"),
-            InlineKeyboardButton("📜 " + ("السجل" if user_langs.get(user_id) == "ar" else "History"), callback_data="action:history"),
+            InlineKeyboardButton("⭐ " + fav, callback_data="action:fav"),
+            InlineKeyboardButton("📜 " + history, callback_data="action:history"),
         ],
         [
-            InlineKeyboardButton("🌐 " + ("اللغة" if user_langs.get(user_id) == "ar" else "Language"), callback_data="action:lang"),
+            InlineKeyboardButton("🌐 " + language, callback_data="action:lang"),
         ],
+    ])
+
+
+START_MARKUP = {
+    "ar": _start_markup("بحث", "فيديو", "مقارنة", "المفضلة", "السجل", "اللغة"),
+    "en": _start_markup("Search", "Video", "Compare", "Favorites", "History", "Language"),
+}
+
+LANG_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🇸🇦 العربية", callback_data="lang:ar"),
+        InlineKeyboardButton("🇺🇸 English", callback_data="lang:en"),
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+])
+
+
+def _result_kb(lang: str, username: str, add_fav: bool = True) -> InlineKeyboardMarkup:
+    """Build the refresh/raw/favorite keyboard shown under a user result."""
+    refresh, raw_data, add_fav_label = _result_labels.get(lang) or _result_labels["ar"]
+    keyboard = [
+        [
+            InlineKeyboardButton(refresh, callback_data=f"refresh:username:{username}"),
+            InlineKeyboardButton(raw_data, callback_data=f"raw:username:{username}"),
+        ]
+    ]
+    if add_fav:
+        keyboard.append([InlineKeyboardButton(add_fav_label, callback_data=f"addfav:{username}")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _fav_list_reply(user_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Render a user's favorites as a numbered list with a search button per entry."""
+    fav_list = list(favorites[user_id].values())
+    response = t(user_id, "fav_title", count=len(fav_list)) + "".join(
+        f"{i}. @{uname}\n" for i, uname in enumerate(fav_list, 1)
+    )
+    keyboard = [[InlineKeyboardButton(f"🔍 @{uname}", callback_data=f"favsearch:{uname}")] for uname in fav_list]
+    return response, InlineKeyboardMarkup(keyboard)
+
+
+def _history_reply(user_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Render a user's recent searches as a numbered list with a search button per entry."""
+    history = search_history[user_id]
+    response = t(user_id, "history_title") + "".join(
+        f"{i}. @{entry['username']} - {entry['time']}\n" for i, entry in enumerate(history, 1)
+    )
+    keyboard = [
+        [InlineKeyboardButton(f"🔍 @{entry['username']}", callback_data=f"favsearch:{entry['username']}")]
+        for entry in history
+    ]
+    return response, InlineKeyboardMarkup(keyboard)
+
+
+async def _reply_with_user(message: Message, user_id: int, identifier: str, by_id: bool = False) -> None:
+    """Look up a user and reply with their profile picture and details."""
+    msg = await message.reply_text(t(user_id, "searching"))
+
+    if by_id:
+        result = await cached_get_user_by_id(identifier)
+    else:
+        result = await cached_get_user(identifier)
+
+    if result.get("error"):
+        await msg.edit_text(t(user_id, "error_not_found"))
+        return
+
+    save_to_history(user_id, result["username"])
+
+    # Send profile picture, reusing Telegram's file_id once it has been uploaded
+    pic_url = result.get("profile_pic")
+    if pic_url:
+        try:
+            sent = await message.reply_photo(photo=photo_cache.get(pic_url, pic_url))
+            photo_cache[pic_url] = sent.photo[-1].file_id
+            photo_cache.move_to_end(pic_url)
+            while len(photo_cache) > PHOTO_CACHE_MAX_ENTRIES:
+                photo_cache.popitem(last=False)
+        except Exception:
+            photo_cache.pop(pic_url, None)
+
+    await msg.edit_text(
+        build_user_response(result, user_id),
+        parse_mode=ParseMode.MARKDOWN_V2,
+        disable_web_page_preview=True,
+        reply_markup=_result_kb(user_langs.get(user_id, "ar"), result["username"]),
+    )
+
+
+# ─── Command Handlers ───────────────────────────────────────────────
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /start command."""
+    user_id = update.effective_user.id
+    lang = user_langs.get(user_id, "ar")
+    reply_markup = START_MARKUP.get(lang, START_MARKUP["en"])
     await update.message.reply_text(
         t(user_id, "welcome"),
         reply_markup=reply_markup,
@@ -233,16 +522,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /lang command."""
     user_id = update.effective_user.id
-    keyboard = [
-        [
-            InlineKeyboardButton("🇸🇦 العربية", callback_data="lang:ar"),
-            InlineKeyboardButton("🇺🇸 English", callback_data="lang:en"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         t(user_id, "choose_lang"),
-        reply_markup=reply_markup,
+        reply_markup=LANG_MARKUP,
     )
 
 
@@ -266,43 +548,7 @@ async def handle_username_input(update: Update, context: ContextTypes.DEFAULT_TY
     """Process username input and fetch data."""
     user_id = update.effective_user.id
     username = update.message.text.strip().lstrip("@")
-
-    msg = await update.message.reply_text(t(user_id, "searching"))
-
-    result = await scraper.get_user_by_username(username)
-
-    if result.get("error"):
-        await msg.edit_text(t(user_id, "error_not_found"))
-        return ConversationHandler.END
-
-    save_to_history(user_id, result["username"])
-
-    # Send profile picture
-    if result.get("profile_pic"):
-        try:
-            await update.message.reply_photo(photo=result["profile_pic"])
-        except Exception:
-            pass
-
-    response = build_user_response(result, user_id)
-
-    keyboard = [
-        [
-            InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-            InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-        ],
-        [
-            InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await msg.edit_text(
-        response,
-        parse_mode=ParseMode.MARKDOWN_V2,
-        disable_web_page_preview=True,
-        reply_markup=reply_markup,
-    )
+    await _reply_with_user(update.message, user_id, username)
     return ConversationHandler.END
 
 
@@ -326,46 +572,41 @@ async def handle_id_input(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Process user ID input and fetch data."""
     user_id = update.effective_user.id
     tiktok_id = update.message.text.strip()
+    await _reply_with_user(update.message, user_id, tiktok_id, by_id=True)
+    return ConversationHandler.END
 
-    msg = await update.message.reply_text(t(user_id, "searching"))
-
-    result = await scraper.get_user_by_id(tiktok_id)
-
-    if result.get("error"):
-        await msg.edit_text(t(user_id, "error_not_found"))
-        return ConversationHandler.END
 
-    save_to_history(user_id, result["username"])
+# ─── Video Download ──────────────────────────────────────────────────
 
-    if result.get("profile_pic"):
-        try:
-            await update.message.reply_photo(photo=result["profile_pic"])
-        except Exception:
-            pass
 
-    response = build_user_response(result, user_id)
+async def _reply_with_video(message: Message, user_id: int, video_url: str) -> None:
+    """Fetch a video without watermark and reply with it."""
+    msg = await message.reply_text(t(user_id, "downloading_video"))
 
-    keyboard = [
-        [
-            InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-            InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-        ],
-        [
-            InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    result = await scraper.get_video_no_watermark(video_url)
 
-    await msg.edit_text(
-        response,
-        parse_mode=ParseMode.MARKDOWN_V2,
-        disable_web_page_preview=True,
-        reply_markup=reply_markup,
-    )
-    return ConversationHandler.END
+    if result.get("error"):
+        await msg.edit_text(t(user_id, "error_video"))
+        return
 
+    try:
+        caption = ""
+        if result.get("title"):
+            caption = f"📝 {result['title']}\n"
+        if result.get("author"):
+            caption += f"👤 @{result['author']}"
 
-# ─── Video Download ──────────────────────────────────────────────────
+        # Telegram pulls the file from the URL itself; allow for slow CDNs
+        await message.reply_video(
+            video=result["video_url"],
+            caption=caption if caption else None,
+            supports_streaming=True,
+            read_timeout=60,
+            write_timeout=60,
+        )
+        await msg.edit_text(t(user_id, "video_sent"))
+    except Exception:
+        await msg.edit_text(t(user_id, "error_video"))
 
 
 async def video_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -386,204 +627,135 @@ async def handle_video_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     video_url = update.message.text.strip()
 
-    msg = await update.message.reply_text(t(user_id, "downloading_video"))
+    await _reply_with_video(update.message, user_id, video_url)
+    return ConversationHandler.END
 
-    result = await scraper.get_video_no_watermark(video_url)
 
-    if result.get("error"):
-        await msg.edit_text(t(user_id, "error_video"))
-        return ConversationHandler.END
+# ─── Callback Handlers ──────────────────────────────────────────────
 
-    try:
-        caption = ""
-        if result.get("title"):
-            caption = f"📝 {result['title']}\n"
-        if result.get("author"):
-            caption += f"👤 @{result['author']}"
 
-        await update.message.reply_video(
-            video=result["video_url"],
-            caption=caption if caption else None,
-            supports_streaming=True,
+async def _cb_lang(query: CallbackQuery, user_id: int, lang_code: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Language selection."""
+    user_langs[user_id] = lang_code
+    await query.message.edit_text(t(user_id, "lang_changed"))
+
+
+async def _cb_action(query: CallbackQuery, user_id: int, action: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Action buttons from /start."""
+    if action == "search":
+        await query.message.reply_text(t(user_id, "ask_username"))
+        context.user_data["pending_action"] = "search"
+    elif action == "id":
+        await query.message.reply_text(t(user_id, "ask_id"))
+        context.user_data["pending_action"] = "id"
+    elif action == "video":
+        await query.message.reply_text(t(user_id, "ask_video_url"))
+        context.user_data["pending_action"] = "video"
+    elif action == "compare":
+        await query.message.reply_text(t(user_id, "ask_compare"))
+        context.user_data["pending_action"] = "compare"
+    elif action == "fav":
+        if user_id not in favorites or not favorites[user_id]:
+            await query.message.reply_text(t(user_id, "fav_empty"))
+        else:
+            response, markup = _fav_list_reply(user_id)
+            await query.message.reply_text(response, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    elif action == "history":
+        if user_id not in search_history or not search_history[user_id]:
+            await query.message.reply_text(t(user_id, "history_empty"))
+        else:
+            response, markup = _history_reply(user_id)
+            await query.message.reply_text(response, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    elif action == "lang":
+        await query.message.reply_text(
+            t(user_id, "choose_lang"),
+            reply_markup=LANG_MARKUP,
         )
-        await msg.edit_text(t(user_id, "video_sent"))
-    except Exception:
-        await msg.edit_text(t(user_id, "error_video"))
 
-    return ConversationHandler.END
 
+async def _cb_refresh(query: CallbackQuery, user_id: int, rest: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Refresh user info."""
+    search_type, _, identifier = rest.partition(":")
 
-# ─── Callback Handlers ──────────────────────────────────────────────
+    is_limited, mins, secs = check_rate_limit(user_id)
+    if is_limited:
+        await query.message.reply_text(t(user_id, "rate_limited", minutes=mins, seconds=secs))
+        return
 
+    if search_type == "username":
+        result = await cached_get_user(identifier)
+    else:
+        result = await cached_get_user_by_id(identifier)
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle all inline button callbacks."""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    data = query.data
-
-    # Language selection
-    if data.startswith("lang:"):
-        lang_code = data.split(":")[1]
-        user_langs[user_id] = lang_code
-        await query.message.edit_text(t(user_id, "lang_changed"))
+    if result.get("error"):
+        await query.message.reply_text(t(user_id, "error_not_found"))
         return
 
-    # Action buttons from /start
-    if data.startswith("action:"):
-        action = data.split(":")[1]
-        if action == "search":
-            await query.message.reply_text(t(user_id, "ask_username"))
-            context.user_data["pending_action"] = "search"
-        elif action == "id":
-            await query.message.reply_text(t(user_id, "ask_id"))
-            context.user_data["pending_action"] = "id"
-        elif action == "video":
-            await query.message.reply_text(t(user_id, "ask_video_url"))
-            context.user_data["pending_action"] = "video"
-        elif action == "compare":
-            await query.message.reply_text(t(user_id, "ask_compare"))
-            context.user_data["pending_action"] = "compare"
-        elif action == "fav":
-            if user_id not in favorites or not favorites[user_id]:
-                await query.message.reply_text(t(user_id, "fav_empty"))
-            else:
-                fav_list = favorites[user_id]
-                response = t(user_id, "fav_title", count=len(fav_list))
-                kb = []
-                for i, uname in enumerate(fav_list, 1):
-                    response += f"{i}. @{uname}\n"
-                    kb.append([InlineKeyboardButton(f"🔍 @{uname}", callback_data=f"favsearch:{uname}")])
-                await query.message.reply_text(response, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(kb))
-        elif action == "history":
-            if user_id not in search_history or not search_history[user_id]:
-                await query.message.reply_text(t(user_id, "history_empty"))
-            else:
-                history = search_history[user_id][:10]
-                response = t(user_id, "history_title")
-                kb = []
-                for i, entry in enumerate(history, 1):
-                    response += f"{i}. @{entry['username']} - {entry['time']}\n"
-                    kb.append([InlineKeyboardButton(f"🔍 @{entry['username']}", callback_data=f"favsearch:{entry['username']}")])
-                await query.message.reply_text(response, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(kb))
-        elif action == "lang":
-            keyboard = [
-                [
-                    InlineKeyboardButton("🇸🇦 العربية", callback_data="lang:ar"),
-                    InlineKeyboardButton("🇺🇸 English", callback_data="lang:en"),
-                ]
-            ]
-            await query.message.reply_text(
-                t(user_id, "choose_lang"),
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-        return
+    response = build_user_response(result, user_id)
+    keyboard = _result_kb(user_langs.get(user_id, "ar"), result["username"], add_fav=False)
+    await query.message.edit_text(
+        response,
+        parse_mode=ParseMode.MARKDOWN_V2,
+        disable_web_page_preview=True,
+        reply_markup=keyboard,
+    )
 
-    # Refresh user info
-    if data.startswith("refresh:"):
-        parts = data.split(":")
-        search_type = parts[1]
-        identifier = parts[2]
 
-        is_limited, mins, secs = check_rate_limit(user_id)
-        if is_limited:
-            await query.message.reply_text(t(user_id, "rate_limited", minutes=mins, seconds=secs))
-            return
+async def _cb_addfav(query: CallbackQuery, user_id: int, username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add to favorites."""
+    status = add_favorite(user_id, username)
+    await query.message.reply_text(t(user_id, status, username=username, limit=FAVORITES_MAX))
 
-        if search_type == "username":
-            result = await scraper.get_user_by_username(identifier)
-        else:
-            result = await scraper.get_user_by_id(identifier)
 
-        if result.get("error"):
-            await query.message.reply_text(t(user_id, "error_not_found"))
-            return
+async def _cb_favsearch(query: CallbackQuery, user_id: int, username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Search from favorites/history."""
+    await _reply_with_user(query.message, user_id, username)
 
-        response = build_user_response(result, user_id)
-        keyboard = [
-            [
-                InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-                InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-            ]
-        ]
-        await query.message.edit_text(
-            response,
-            parse_mode=ParseMode.MARKDOWN_V2,
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-        return
 
-    # Add to favorites
-    if data.startswith("addfav:"):
-        username = data.split(":", 1)[1]
-        if user_id not in favorites:
-            favorites[user_id] = []
-        if username.lower() in [f.lower() for f in favorites[user_id]]:
-            await query.message.reply_text(t(user_id, "fav_exists", username=username))
-        else:
-            favorites[user_id].append(username)
-            await query.message.reply_text(t(user_id, "fav_added", username=username))
-        return
+async def _cb_raw(query: CallbackQuery, user_id: int, rest: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Raw data."""
+    search_type, _, identifier = rest.partition(":")
 
-    # Search from favorites/history
-    if data.startswith("favsearch:"):
-        username = data.split(":", 1)[1]
-        result = await scraper.get_user_by_username(username)
-        if result.get("error"):
-            await query.message.reply_text(t(user_id, "error_not_found"))
-            return
-        save_to_history(user_id, result["username"])
-        if result.get("profile_pic"):
-            try:
-                await query.message.reply_photo(photo=result["profile_pic"])
-            except Exception:
-                pass
-        response = build_user_response(result, user_id)
-        keyboard = [
-            [
-                InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-                InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-            ],
-            [
-                InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-            ]
-        ]
-        await query.message.reply_text(
-            response,
-            parse_mode=ParseMode.MARKDOWN_V2,
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+    result = await cached_get_user(identifier)
+
+    if result.get("error"):
+        await query.message.reply_text(t(user_id, "error_not_found"))
         return
 
-    # Raw data
-    if data.startswith("raw:"):
-        parts = data.split(":")
-        search_type = parts[1]
-        identifier = parts[2]
+    raw_data = {
+        "user": result.get("raw_user", {}),
+        "stats": result.get("raw_stats", {}),
+    }
 
-        result = await scraper.get_user_by_username(identifier)
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    filename = f"{date_str}_{identifier}_raw.json"
+    if HAS_ORJSON:
+        json_data = orjson.dumps(raw_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        json_data = json.dumps(raw_data, indent=2, ensure_ascii=False).encode("utf-8")
 
-        if result.get("error"):
-            await query.message.reply_text(t(user_id, "error_not_found"))
-            return
+    await query.message.reply_document(document=json_data, filename=filename)
 
-        raw_data = {
-            "user": result.get("raw_user", {}),
-            "stats": result.get("raw_stats", {}),
-        }
 
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        filename = f"{date_str}_{identifier}_raw.json"
-        json_data = json.dumps(raw_data, indent=2, ensure_ascii=False)
-        bio = BytesIO(json_data.encode("utf-8"))
-        bio.name = filename
-        bio.seek(0)
+# Callback data prefix -> handler
+_CB_DISPATCH = {
+    "lang": _cb_lang,
+    "action": _cb_action,
+    "refresh": _cb_refresh,
+    "addfav": _cb_addfav,
+    "favsearch": _cb_favsearch,
+    "raw": _cb_raw,
+}
 
-        await query.message.reply_document(document=bio, filename=filename)
-        return
+
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle all inline button callbacks."""
+    query = update.callback_query
+    await query.answer()
+    head, _, rest = query.data.partition(":")
+    handler = _CB_DISPATCH.get(head)
+    if handler:
+        await handler(query, query.from_user.id, rest, context)
 
 
 # ─── Fallback message handler for action buttons ────────────────────
@@ -603,37 +775,7 @@ async def handle_pending_action(update: Update, context: ContextTypes.DEFAULT_TY
                 await update.message.reply_text(t(user_id, "rate_limited", minutes=mins, seconds=secs))
                 return
 
-            msg = await update.message.reply_text(t(user_id, "searching"))
-            result = await scraper.get_user_by_username(username)
-
-            if result.get("error"):
-                await msg.edit_text(t(user_id, "error_not_found"))
-                return
-
-            save_to_history(user_id, result["username"])
-
-            if result.get("profile_pic"):
-                try:
-                    await update.message.reply_photo(photo=result["profile_pic"])
-                except Exception:
-                    pass
-
-            response = build_user_response(result, user_id)
-            keyboard = [
-                [
-                    InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-                    InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-                ],
-                [
-                    InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-                ]
-            ]
-            await msg.edit_text(
-                response,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                disable_web_page_preview=True,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
+            await _reply_with_user(update.message, user_id, username)
         return
 
     context.user_data.pop("pending_action", None)
@@ -645,37 +787,7 @@ async def handle_pending_action(update: Update, context: ContextTypes.DEFAULT_TY
             await update.message.reply_text(t(user_id, "rate_limited", minutes=mins, seconds=secs))
             return
 
-        msg = await update.message.reply_text(t(user_id, "searching"))
-        result = await scraper.get_user_by_username(text)
-
-        if result.get("error"):
-            await msg.edit_text(t(user_id, "error_not_found"))
-            return
-
-        save_to_history(user_id, result["username"])
-
-        if result.get("profile_pic"):
-            try:
-                await update.message.reply_photo(photo=result["profile_pic"])
-            except Exception:
-                pass
-
-        response = build_user_response(result, user_id)
-        keyboard = [
-            [
-                InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-                InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-            ],
-            [
-                InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-            ]
-        ]
-        await msg.edit_text(
-            response,
-            parse_mode=ParseMode.MARKDOWN_V2,
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+        await _reply_with_user(update.message, user_id, text)
 
     elif pending == "id":
         is_limited, mins, secs = check_rate_limit(user_id)
@@ -683,37 +795,7 @@ async def handle_pending_action(update: Update, context: ContextTypes.DEFAULT_TY
             await update.message.reply_text(t(user_id, "rate_limited", minutes=mins, seconds=secs))
             return
 
-        msg = await update.message.reply_text(t(user_id, "searching"))
-        result = await scraper.get_user_by_id(text)
-
-        if result.get("error"):
-            await msg.edit_text(t(user_id, "error_not_found"))
-            return
-
-        save_to_history(user_id, result["username"])
-
-        if result.get("profile_pic"):
-            try:
-                await update.message.reply_photo(photo=result["profile_pic"])
-            except Exception:
-                pass
-
-        response = build_user_response(result, user_id)
-        keyboard = [
-            [
-                InlineKeyboardButton(t(user_id, "refresh"), callback_data=f"refresh:username:{result['username']}"),
-                InlineKeyboardButton(t(user_id, "raw_data"), callback_data=f"raw:username:{result['username']}"),
-            ],
-            [
-                InlineKeyboardButton(t(user_id, "add_fav"), callback_data=f"addfav:{result['username']}"),
-            ]
-        ]
-        await msg.edit_text(
-            response,
-            parse_mode=ParseMode.MARKDOWN_V2,
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+        await _reply_with_user(update.message, user_id, text, by_id=True)
 
     elif pending == "compare":
         parts = text.split()
@@ -723,57 +805,15 @@ async def handle_pending_action(update: Update, context: ContextTypes.DEFAULT_TY
         user1_name = parts[0].lstrip("@")
         user2_name = parts[1].lstrip("@")
         msg = await update.message.reply_text(t(user_id, "comparing"))
-        result1 = await scraper.get_user_by_username(user1_name)
-        result2 = await scraper.get_user_by_username(user2_name)
+        result1, result2 = await fetch_pair(user1_name, user2_name)
         if result1.get("error") or result2.get("error"):
             await msg.edit_text(t(user_id, "error_compare"))
             return
-        response = t(user_id, "compare_title")
-        compare_fields = [
-            ("username", "username"), ("nickname", "nickname"),
-            ("followers", "followers"), ("following", "following"),
-            ("likes", "likes"), ("videos", "videos"),
-            ("verified", "verified"), ("created", "created"),
-            ("region", "region"), ("language_field", "language"),
-        ]
-        vs = t(user_id, "vs")
-        for label_key, data_key in compare_fields:
-            label = t(user_id, label_key)
-            v1 = result1.get(data_key, "N/A")
-            v2 = result2.get(data_key, "N/A")
-            if data_key == "verified":
-                v1 = t(user_id, "yes") if v1 else t(user_id, "no")
-                v2 = t(user_id, "yes") if v2 else t(user_id, "no")
-            safe_label = escape_markdown(str(label), version=2)
-            safe_v1 = escape_markdown(str(v1), version=2)
-            safe_v2 = escape_markdown(str(v2), version=2)
-            safe_vs = escape_markdown(vs, version=2)
-            response += f"*{safe_label}:*\n{safe_v1} {safe_vs} {safe_v2}\n\n"
+        response = build_compare_response(result1, result2, user_id)
         await msg.edit_text(response, parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True)
 
     elif pending == "video":
-        msg = await update.message.reply_text(t(user_id, "downloading_video"))
-        result = await scraper.get_video_no_watermark(text)
-
-        if result.get("error"):
-            await msg.edit_text(t(user_id, "error_video"))
-            return
-
-        try:
-            caption = ""
-            if result.get("title"):
-                caption = f"📝 {result['title']}\n"
-            if result.get("author"):
-                caption += f"👤 @{result['author']}"
-
-            await update.message.reply_video(
-                video=result["video_url"],
-                caption=caption if caption else None,
-                supports_streaming=True,
-            )
-            await msg.edit_text(t(user_id, "video_sent"))
-        except Exception:
-            await msg.edit_text(t(user_id, "error_video"))
+        await _reply_with_video(update.message, user_id, text)
 
 
 # ─── Compare Two Accounts ────────────────────────────────────────────
@@ -804,41 +844,13 @@ async def handle_compare_input(update: Update, context: ContextTypes.DEFAULT_TYP
 
     msg = await update.message.reply_text(t(user_id, "comparing"))
 
-    result1 = await scraper.get_user_by_username(user1_name)
-    result2 = await scraper.get_user_by_username(user2_name)
+    result1, result2 = await fetch_pair(user1_name, user2_name)
 
     if result1.get("error") or result2.get("error"):
         await msg.edit_text(t(user_id, "error_compare"))
         return ConversationHandler.END
 
-    response = t(user_id, "compare_title")
-
-    compare_fields = [
-        ("username", "username", "username"),
-        ("nickname", "nickname", "nickname"),
-        ("followers", "followers", "followers"),
-        ("following", "following", "following"),
-        ("likes", "likes", "likes"),
-        ("videos", "videos", "videos"),
-        ("verified", "verified", "verified"),
-        ("created", "created", "created"),
-        ("region", "region", "region"),
-        ("language_field", "language", "language"),
-    ]
-
-    vs = t(user_id, "vs")
-    for label_key, data_key, _ in compare_fields:
-        label = t(user_id, label_key)
-        v1 = result1.get(data_key, "N/A")
-        v2 = result2.get(data_key, "N/A")
-        if data_key == "verified":
-            v1 = t(user_id, "yes") if v1 else t(user_id, "no")
-            v2 = t(user_id, "yes") if v2 else t(user_id, "no")
-        safe_label = escape_markdown(str(label), version=2)
-        safe_v1 = escape_markdown(str(v1), version=2)
-        safe_v2 = escape_markdown(str(v2), version=2)
-        safe_vs = escape_markdown(vs, version=2)
-        response += f"*{safe_label}:*\n{safe_v1} {safe_vs} {safe_v2}\n\n"
+    response = build_compare_response(result1, result2, user_id)
 
     await msg.edit_text(
         response,
@@ -859,20 +871,16 @@ async def fav_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # /fav add username
     if len(args) >= 3 and args[1].lower() == "add":
         username = args[2].lstrip("@")
-        if user_id not in favorites:
-            favorites[user_id] = []
-        if username.lower() in [f.lower() for f in favorites[user_id]]:
-            await update.message.reply_text(t(user_id, "fav_exists", username=username))
-        else:
-            favorites[user_id].append(username)
-            await update.message.reply_text(t(user_id, "fav_added", username=username))
+        status = add_favorite(user_id, username)
+        await update.message.reply_text(t(user_id, status, username=username, limit=FAVORITES_MAX))
         return
 
     # /fav remove username
     if len(args) >= 3 and args[1].lower() in ("remove", "del", "rm"):
         username = args[2].lstrip("@")
-        if user_id in favorites:
-            favorites[user_id] = [f for f in favorites[user_id] if f.lower() != username.lower()]
+        user_favs = favorites.get(user_id)
+        if user_favs:
+            user_favs.pop(username.lower(), None)
         await update.message.reply_text(t(user_id, "fav_removed", username=username))
         return
 
@@ -881,17 +889,11 @@ async def fav_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text(t(user_id, "fav_empty"))
         return
 
-    fav_list = favorites[user_id]
-    response = t(user_id, "fav_title", count=len(fav_list))
-    keyboard = []
-    for i, username in enumerate(fav_list, 1):
-        response += f"{i}. @{username}\n"
-        keyboard.append([InlineKeyboardButton(f"🔍 @{username}", callback_data=f"favsearch:{username}")])
-
+    response, markup = _fav_list_reply(user_id)
     await update.message.reply_text(
         response,
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
+        reply_markup=markup,
     )
 
 
@@ -906,17 +908,11 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(t(user_id, "history_empty"))
         return
 
-    history = search_history[user_id][:10]
-    response = t(user_id, "history_title")
-    keyboard = []
-    for i, entry in enumerate(history, 1):
-        response += f"{i}. @{entry['username']} - {entry['time']}\n"
-        keyboard.append([InlineKeyboardButton(f"🔍 @{entry['username']}", callback_data=f"favsearch:{entry['username']}")])
-
+    response, markup = _history_reply(user_id)
     await update.message.reply_text(
         response,
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
+        reply_markup=markup,
     )
 
 
@@ -941,6 +937,34 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Error handler failed: {e}")
 
 
+# ─── Lifecycle ──────────────────────────────────────────────────────
+
+
+# Stores kept across restarts via bot_data. Rate limit buckets use
+# monotonic time, which is meaningless after a restart, so they are not saved.
+PERSISTED_STORES = {
+    "user_langs": user_langs,
+    "search_history": search_history,
+    "favorites": favorites,
+    "username_tracker": username_tracker,
+}
+
+
+async def post_init(application: Application) -> None:
+    """Open shared resources once the application is initialized."""
+    await scraper.startup()
+
+    # Share the per-user stores with bot_data so the persistence saves them
+    for name, store in PERSISTED_STORES.items():
+        store.update(application.bot_data.get(name, {}))
+        application.bot_data[name] = store
+
+
+async def post_shutdown(application: Application) -> None:
+    """Release shared resources on shutdown."""
+    await scraper.shutdown()
+
+
 # ─── Main ────────────────────────────────────────────────────────────
 
 
@@ -956,7 +980,33 @@ def main():
         print("=" * 50)
         return
 
-    app = Application.builder().token(token).build()
+    # Faster event loop where available (uvloop has no Windows support)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=30,
+        overall_time_period=1,
+        group_max_rate=20,
+        group_time_period=60,
+        max_retries=3,
+    )
+    persistence = PicklePersistence(
+        filepath=PERSISTENCE_FILE,
+        store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=False, callback_data=False),
+    )
+    app = (
+        Application.builder()
+        .token(token)
+        .rate_limiter(rate_limiter)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Conversation handlers
     search_conv = ConversationHandler(
@@ -997,24 +1047,13 @@ def main():
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_pending_action))
     app.add_error_handler(error_handler)
 
+    app.job_queue.run_repeating(prune_idle_state, interval=STATE_GC_INTERVAL, first=STATE_GC_INTERVAL)
+
     # Health check server for Render
     PORT = int(os.environ.get("PORT", 7860))
 
-    class HealthHandler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-
-        def log_message(self, format, *args):
-            pass
-
-    def run_health_server():
-        server = HTTPServer(("0.0.0.0", PORT), HealthHandler)
-        server.serve_forever()
-
-    threading.Thread(target=run_health_server, daemon=True).start()
+    from health import start_healthcheck
+    start_healthcheck(PORT)
 
     print(f"🤖 Bot is running... (health check on port {PORT})")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,24 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Answers every GET with 200 OK for the hosting platform's health check."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_healthcheck(port: int) -> None:
+    """Serve the health check endpoint from a daemon thread."""
+    def run_health_server():
+        server = HTTPServer(("0.0.0.0", port), HealthHandler)
+        server.serve_forever()
+
+    threading.Thread(target=run_health_server, daemon=True).start()
@@ -1,7 +1,9 @@
 import httpx
 import json
-import re
 import asyncio
+import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 try:
@@ -10,11 +12,90 @@ try:
 except ImportError:
     HAS_YTDLP = False
 
+# httpx only negotiates HTTP/2 when the optional h2 package is installed
+HAS_H2 = importlib.util.find_spec("h2") is not None
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+_json_loads = orjson.loads if HAS_ORJSON else json.loads
+
+# yt-dlp blocks a thread for seconds per extraction; keep it off the default executor
+_YTDLP_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ytdlp")
+
+# Per-request override for the JSON endpoints; merged over the client headers
+_JSON_ACCEPT = {"Accept": "application/json"}
+
+_format_thousands = "{:,}".format
+
+# English month abbreviations, independent of the server locale (unlike %b)
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+_REHYDRATION_MARKER = b'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"'
+
+_REGION_MAP = {
+    "US": "United States 🇺🇸", "GB": "United Kingdom 🇬🇧",
+    "CA": "Canada 🇨🇦", "AU": "Australia 🇦🇺",
+    "DE": "Germany 🇩🇪", "FR": "France 🇫🇷",
+    "SA": "Saudi Arabia 🇸🇦", "AE": "UAE 🇦🇪",
+    "EG": "Egypt 🇪🇬", "KW": "Kuwait 🇰🇼",
+    "QA": "Qatar 🇶🇦", "BH": "Bahrain 🇧🇭",
+    "OM": "Oman 🇴🇲", "JO": "Jordan 🇯🇴",
+    "IQ": "Iraq 🇮🇶", "LB": "Lebanon 🇱🇧",
+    "MA": "Morocco 🇲🇦", "DZ": "Algeria 🇩🇿",
+    "TN": "Tunisia 🇹🇳", "LY": "Libya 🇱🇾",
+    "SD": "Sudan 🇸🇩", "YE": "Yemen 🇾🇪",
+    "PS": "Palestine 🇵🇸", "SY": "Syria 🇸🇾",
+    "TR": "Turkey 🇹🇷", "IN": "India 🇮🇳",
+    "BR": "Brazil 🇧🇷", "MX": "Mexico 🇲🇽",
+    "JP": "Japan 🇯🇵", "KR": "South Korea 🇰🇷",
+    "ID": "Indonesia 🇮🇩", "PH": "Philippines 🇵🇭",
+    "TH": "Thailand 🇹🇭", "VN": "Vietnam 🇻🇳",
+    "MY": "Malaysia 🇲🇾", "PK": "Pakistan 🇵🇰",
+    "RU": "Russia 🇷🇺", "IT": "Italy 🇮🇹",
+    "ES": "Spain 🇪🇸", "NL": "Netherlands 🇳🇱",
+    "PL": "Poland 🇵🇱", "SE": "Sweden 🇸🇪",
+    "NG": "Nigeria 🇳🇬", "ZA": "South Africa 🇿🇦",
+    "CO": "Colombia 🇨🇴", "AR": "Argentina 🇦🇷",
+    "CL": "Chile 🇨🇱", "PE": "Peru 🇵🇪",
+}
+
+_LANG_MAP = {
+    "en": "English 🇺🇸", "ar": "العربية 🇸🇦",
+    "fr": "Français 🇫🇷", "de": "Deutsch 🇩🇪",
+    "es": "Español 🇪🇸", "pt": "Português 🇧🇷",
+    "ja": "日本語 🇯🇵", "ko": "한국어 🇰🇷",
+    "zh": "中文 🇨🇳", "hi": "हिन्दी 🇮🇳",
+    "tr": "Türkçe 🇹🇷", "ru": "Русский 🇷🇺",
+    "id": "Bahasa Indonesia 🇮🇩", "th": "ไทย 🇹🇭",
+    "vi": "Tiếng Việt 🇻🇳", "it": "Italiano 🇮🇹",
+    "nl": "Nederlands 🇳🇱", "pl": "Polski 🇵🇱",
+    "ms": "Bahasa Melayu 🇲🇾", "tl": "Filipino 🇵🇭",
+    "ur": "اردو 🇵🇰", "fa": "فارسی 🇮🇷",
+}
+
+
+def _extract_rehydration_json(html: bytes) -> bytes | None:
+    """Return the JSON payload of TikTok's embedded rehydration script."""
+    start = html.find(_REHYDRATION_MARKER)
+    if start < 0:
+        return None
+    start = html.find(b">", start) + 1
+    end = html.find(b"</script>", start)
+    if not start or end < 0:
+        return None
+    return html[start:end]
+
 
 class TikTokScraper:
     """Scrapes TikTok user info directly from tiktok.com and video data via tikwm."""
 
     TIKWM_API = "https://www.tikwm.com/api"
+    YTDLP_FAILURE_LIMIT = 3  # consecutive failures before yt-dlp is skipped
+    YTDLP_COOLDOWN = 60  # seconds
 
     def __init__(self):
         self.headers = {
@@ -24,52 +105,76 @@ class TikTokScraper:
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.9,ar;q=0.8",
         }
+        self._client: httpx.AsyncClient | None = None
+        self._ytdlp_failures = 0
+        self._ytdlp_cooldown_until = 0.0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, opening it on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=20,
+                headers=self.headers,
+                follow_redirects=True,
+                http2=HAS_H2,
+                # Keep idle connections well past httpx's 5s default so lookups a
+                # minute apart still reuse an open TLS connection
+                limits=httpx.Limits(
+                    max_connections=64,
+                    max_keepalive_connections=20,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def startup(self):
+        """Open the shared HTTP client used by all requests."""
+        self._get_client()
+
+    async def shutdown(self):
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def _scrape_tiktok_page(self, url: str) -> dict | None:
         """Scrape a TikTok page and extract embedded JSON data."""
         try:
-            async with httpx.AsyncClient(timeout=20, headers=self.headers, follow_redirects=True) as client:
-                response = await client.get(url)
-                if response.status_code != 200:
-                    return None
-
-                html = response.text
-                match = re.search(
-                    r'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"[^>]*>(.*?)</script>',
-                    html,
-                    re.DOTALL,
-                )
-                if not match:
-                    return None
+            response = await self._get_client().get(url)
+            if response.status_code != 200:
+                return None
 
-                data = json.loads(match.group(1))
-                scope = data.get("__DEFAULT_SCOPE__", {})
-                user_detail = scope.get("webapp.user-detail", {})
-                user_info = user_detail.get("userInfo")
+            html = response.content
+            payload = _extract_rehydration_json(html)
+            if not payload:
+                return None
 
-                if not user_info or user_detail.get("statusCode") != 0:
-                    return None
+            data = _json_loads(payload)
+            scope = data.get("__DEFAULT_SCOPE__", {})
+            user_detail = scope.get("webapp.user-detail", {})
+            user_info = user_detail.get("userInfo")
 
-                return user_info
+            if not user_info or user_detail.get("statusCode") != 0:
+                return None
+
+            return user_info
 
         except Exception:
             return None
 
     async def get_user_by_username(self, username: str) -> dict:
         """Fetch TikTok user details by username."""
-        username = username.strip().lstrip("@").strip("/")
+        username = username.strip().lstrip("@").strip("/").lstrip("@")
 
         # Handle full URLs
         if "tiktok.com" in username:
-            match = re.search(r'tiktok\.com/@([^/?]+)', username)
-            if match:
-                username = match.group(1)
-            else:
+            username = username.partition("tiktok.com/@")[2]
+            for sep in ("/", "?"):
+                username = username.partition(sep)[0]
+            username = username.lstrip("@")
+            if not username:
                 return {"error": True}
 
-        # Remove @ if still present
-        username = username.lstrip("@")
-
         user_info = await self._scrape_tiktok_page(f"https://www.tiktok.com/@{username}")
         if not user_info:
             return {"error": True}
@@ -88,17 +193,16 @@ class TikTokScraper:
 
         # Try tikwm API for ID lookup
         try:
-            api_headers = {**self.headers, "Accept": "application/json"}
-            async with httpx.AsyncClient(timeout=20, headers=api_headers, follow_redirects=True) as client:
-                response = await client.post(
-                    f"{self.TIKWM_API}/user/info",
-                    data={"user_id": user_id},
-                )
-                data = response.json()
-                if data.get("code") == 0 and data.get("data"):
-                    user = data["data"]["user"]
-                    stats = data["data"]["stats"]
-                    return self._format_user(user, stats)
+            response = await self._get_client().post(
+                f"{self.TIKWM_API}/user/info",
+                data={"user_id": user_id},
+                headers=_JSON_ACCEPT,
+            )
+            data = _json_loads(response.content)
+            if data.get("code") == 0 and data.get("data"):
+                user = data["data"]["user"]
+                stats = data["data"]["stats"]
+                return self._format_user(user, stats)
         except Exception:
             pass
 
@@ -113,83 +217,77 @@ class TikTokScraper:
 
     async def get_video_no_watermark(self, url: str) -> dict:
         """Download TikTok video without watermark using multiple methods."""
+        # Short links (vm.tiktok.com, vt.tiktok.com) are left as-is: the client follows
+        # redirects, and yt-dlp and tikwm both resolve them themselves
         url = url.strip()
 
-        # Handle short URLs (vm.tiktok.com, vt.tiktok.com)
-        if "vm.tiktok.com" in url or "vt.tiktok.com" in url:
-            try:
-                async with httpx.AsyncClient(timeout=10, headers=self.headers, follow_redirects=True) as client:
-                    response = await client.head(url)
-                    url = str(response.url)
-            except Exception:
-                pass
-
-        # Method 1: yt-dlp (most reliable)
-        if HAS_YTDLP:
-            try:
-                result = await self._ytdlp_download(url)
-                if result and not result.get("error"):
-                    return result
-            except Exception:
-                pass
+        # Method 1: yt-dlp (most reliable), skipped while its circuit breaker is open
+        if HAS_YTDLP and time.monotonic() >= self._ytdlp_cooldown_until:
+            result = await self._ytdlp_download(url)
+            if result:
+                return result
 
         # Method 2: Direct page scraping
-        try:
-            async with httpx.AsyncClient(timeout=20, headers=self.headers, follow_redirects=True) as client:
-                response = await client.get(url)
-                html = response.text
-                match = re.search(
-                    r'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"[^>]*>(.*?)</script>',
-                    html,
-                    re.DOTALL,
-                )
-                if match:
-                    data = json.loads(match.group(1))
-                    scope = data.get("__DEFAULT_SCOPE__", {})
-                    item_detail = scope.get("webapp.video-detail", {})
-                    item_info = item_detail.get("itemInfo", {}).get("itemStruct", {})
-
-                    video = item_info.get("video", {})
-                    download_url = video.get("downloadAddr") or video.get("playAddr")
-
-                    if download_url:
-                        return {
-                            "error": False,
-                            "video_url": download_url,
-                            "music_url": item_info.get("music", {}).get("playUrl"),
-                            "title": item_info.get("desc", ""),
-                            "author": item_info.get("author", {}).get("uniqueId", ""),
-                            "duration": video.get("duration", 0),
-                            "cover": video.get("cover"),
-                        }
-        except Exception:
-            pass
+        result = await self._scrape_video_page(url)
+        if result:
+            return result
 
         # Method 3: tikwm API (fallback)
+        return await self._tikwm_video(url) or {"error": True}
+
+    async def _scrape_video_page(self, url: str) -> dict | None:
+        """Extract the video download URL from the TikTok page itself."""
         try:
-            api_headers = {**self.headers, "Accept": "application/json"}
-            async with httpx.AsyncClient(timeout=15, headers=api_headers, follow_redirects=True) as client:
-                response = await client.post(
-                    f"{self.TIKWM_API}/",
-                    data={"url": url, "hd": 1},
-                )
-                data = response.json()
+            response = await self._get_client().get(url)
+            payload = _extract_rehydration_json(response.content)
+            if payload:
+                data = _json_loads(payload)
+                scope = data.get("__DEFAULT_SCOPE__", {})
+                item_detail = scope.get("webapp.video-detail", {})
+                item_info = item_detail.get("itemInfo", {}).get("itemStruct", {})
+
+                video = item_info.get("video", {})
+                download_url = video.get("downloadAddr") or video.get("playAddr")
 
-                if data.get("code") == 0 and data.get("data"):
-                    video_data = data["data"]
+                if download_url:
                     return {
                         "error": False,
-                        "video_url": video_data.get("hdplay") or video_data.get("play"),
-                        "music_url": video_data.get("music"),
-                        "title": video_data.get("title", ""),
-                        "author": video_data.get("author", {}).get("unique_id", ""),
-                        "duration": video_data.get("duration", 0),
-                        "cover": video_data.get("cover"),
+                        "video_url": download_url,
+                        "music_url": item_info.get("music", {}).get("playUrl"),
+                        "title": item_info.get("desc", ""),
+                        "author": item_info.get("author", {}).get("uniqueId", ""),
+                        "duration": video.get("duration", 0),
+                        "cover": video.get("cover"),
                     }
         except Exception:
             pass
+        return None
 
-        return {"error": True}
+    async def _tikwm_video(self, url: str) -> dict | None:
+        """Resolve the video through the tikwm API."""
+        try:
+            response = await self._get_client().post(
+                f"{self.TIKWM_API}/",
+                data={"url": url, "hd": 1},
+                headers=_JSON_ACCEPT,
+                timeout=15,
+            )
+            data = _json_loads(response.content)
+
+            if data.get("code") == 0 and data.get("data"):
+                video_data = data["data"]
+                return {
+                    "error": False,
+                    "video_url": video_data.get("hdplay") or video_data.get("play"),
+                    "music_url": video_data.get("music"),
+                    "title": video_data.get("title", ""),
+                    "author": video_data.get("author", {}).get("unique_id", ""),
+                    "duration": video_data.get("duration", 0),
+                    "cover": video_data.get("cover"),
+                }
+        except Exception:
+            pass
+        return None
 
     async def _ytdlp_download(self, url: str) -> dict | None:
         """Use yt-dlp to extract video info."""
@@ -206,16 +304,15 @@ class TikTokScraper:
                 return ydl.extract_info(url, download=False)
 
         try:
-            loop = asyncio.get_event_loop()
-            info = await loop.run_in_executor(None, _extract)
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(_YTDLP_EXEC, _extract)
             if info:
-                video_url = info.get("url")
-                if not video_url and info.get("formats"):
-                    for fmt in reversed(info["formats"]):
-                        if fmt.get("url"):
-                            video_url = fmt["url"]
-                            break
+                video_url = info.get("url") or next(
+                    (fmt["url"] for fmt in reversed(info.get("formats") or ()) if fmt.get("url")),
+                    None,
+                )
                 if video_url:
+                    self._ytdlp_failures = 0
                     return {
                         "error": False,
                         "video_url": video_url,
@@ -227,18 +324,23 @@ class TikTokScraper:
                     }
         except Exception:
             pass
+
+        # Circuit breaker: after repeated failures, stop waiting on yt-dlp for a while
+        self._ytdlp_failures += 1
+        if self._ytdlp_failures >= self.YTDLP_FAILURE_LIMIT:
+            self._ytdlp_failures = 0
+            self._ytdlp_cooldown_until = time.monotonic() + self.YTDLP_COOLDOWN
         return None
 
     def _format_user(self, user: dict, stats: dict) -> dict:
         """Format raw TikTok API data into a clean dict."""
-        create_time = user.get("createTime", 0)
-        if create_time:
-            try:
-                created_str = datetime.fromtimestamp(
-                    int(create_time), tz=timezone.utc
-                ).strftime("%d %b %Y %H:%M UTC")
-            except (ValueError, OSError):
-                created_str = "N/A"
+        create_time = user.get("createTime") or 0
+        if isinstance(create_time, (int, float)) and 0 < create_time < 2_000_000_000:
+            created = datetime.fromtimestamp(int(create_time), tz=timezone.utc)
+            created_str = (
+                f"{created.day:02d} {_MONTHS[created.month - 1]} {created.year} "
+                f"{created.hour:02d}:{created.minute:02d} UTC"
+            )
         else:
             created_str = "N/A"
 
@@ -288,36 +390,9 @@ class TikTokScraper:
     @staticmethod
     def _resolve_region(region: str | None, language: str | None) -> str:
         """Resolve region from available data."""
-        REGION_MAP = {
-            "US": "United States 🇺🇸", "GB": "United Kingdom 🇬🇧",
-            "CA": "Canada 🇨🇦", "AU": "Australia 🇦🇺",
-            "DE": "Germany 🇩🇪", "FR": "France 🇫🇷",
-            "SA": "Saudi Arabia 🇸🇦", "AE": "UAE 🇦🇪",
-            "EG": "Egypt 🇪🇬", "KW": "Kuwait 🇰🇼",
-            "QA": "Qatar 🇶🇦", "BH": "Bahrain 🇧🇭",
-            "OM": "Oman 🇴🇲", "JO": "Jordan 🇯🇴",
-            "IQ": "Iraq 🇮🇶", "LB": "Lebanon 🇱🇧",
-            "MA": "Morocco 🇲🇦", "DZ": "Algeria 🇩🇿",
-            "TN": "Tunisia 🇹🇳", "LY": "Libya 🇱🇾",
-            "SD": "Sudan 🇸🇩", "YE": "Yemen 🇾🇪",
-            "PS": "Palestine 🇵🇸", "SY": "Syria 🇸🇾",
-            "TR": "Turkey 🇹🇷", "IN": "India 🇮🇳",
-            "BR": "Brazil 🇧🇷", "MX": "Mexico 🇲🇽",
-            "JP": "Japan 🇯🇵", "KR": "South Korea 🇰🇷",
-            "ID": "Indonesia 🇮🇩", "PH": "Philippines 🇵🇭",
-            "TH": "Thailand 🇹🇭", "VN": "Vietnam 🇻🇳",
-            "MY": "Malaysia 🇲🇾", "PK": "Pakistan 🇵🇰",
-            "RU": "Russia 🇷🇺", "IT": "Italy 🇮🇹",
-            "ES": "Spain 🇪🇸", "NL": "Netherlands 🇳🇱",
-            "PL": "Poland 🇵🇱", "SE": "Sweden 🇸🇪",
-            "NG": "Nigeria 🇳🇬", "ZA": "South Africa 🇿🇦",
-            "CO": "Colombia 🇨🇴", "AR": "Argentina 🇦🇷",
-            "CL": "Chile 🇨🇱", "PE": "Peru 🇵🇪",
-        }
-        if region and region.upper() in REGION_MAP:
-            return REGION_MAP[region.upper()]
         if region:
-            return region.upper()
+            code = region.upper()
+            return _REGION_MAP.get(code, code)
         return "N/A"
 
     @staticmethod
@@ -325,25 +400,14 @@ class TikTokScraper:
         """Convert language code to readable name."""
         if not code:
             return "N/A"
-        LANG_MAP = {
-            "en": "English 🇺🇸", "ar": "العربية 🇸🇦",
-            "fr": "Français 🇫🇷", "de": "Deutsch 🇩🇪",
-            "es": "Español 🇪🇸", "pt": "Português 🇧🇷",
-            "ja": "日本語 🇯🇵", "ko": "한국어 🇰🇷",
-            "zh": "中文 🇨🇳", "hi": "हिन्दी 🇮🇳",
-            "tr": "Türkçe 🇹🇷", "ru": "Русский 🇷🇺",
-            "id": "Bahasa Indonesia 🇮🇩", "th": "ไทย 🇹🇭",
-            "vi": "Tiếng Việt 🇻🇳", "it": "Italiano 🇮🇹",
-            "nl": "Nederlands 🇳🇱", "pl": "Polski 🇵🇱",
-            "ms": "Bahasa Melayu 🇲🇾", "tl": "Filipino 🇵🇭",
-            "ur": "اردو 🇵🇰", "fa": "فارسی 🇮🇷",
-        }
-        return LANG_MAP.get(code.lower(), code)
+        return _LANG_MAP.get(code.lower(), code)
 
     @staticmethod
     def _format_number(num) -> str:
         """Format large numbers with commas."""
+        if isinstance(num, int):
+            return _format_thousands(num)
         try:
-            return f"{int(num):,}"
+            return _format_thousands(int(num))
         except (ValueError, TypeError):
             return str(num)